@@ -1,17 +1,19 @@
 import streamlit as st
 import ollama
+import asyncio
+import httpx
 import json
-import os
-import hashlib
+import orjson
+import re
+import sqlite3
+import threading
+import numpy as np
 import pandas as pd
-from sklearn.tree import DecisionTreeClassifier
-import base64
-import random
 import urllib.parse
+from pathlib import Path
 
 # ⬇️ Loader animation
-def show_loader(placeholder):
-    placeholder.markdown("""
+LOADER_HTML = """
     <style>
         .loader-wrapper {
             display: flex;
@@ -45,10 +47,25 @@ def show_loader(placeholder):
         <div class="ring ring1"></div>
         <div class="ring ring2"></div>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
-# 🔍 Query LLaMA 3 to extract parts info
-def parse_query_llama3(query):
+def show_loader(placeholder):
+    placeholder.markdown(LOADER_HTML, unsafe_allow_html=True)
+
+# 🔎 Spot the search fields in a partially streamed reply: "key": "value" with the value closed
+SEARCH_FIELD_PATTERNS = [
+    re.compile(rf'"{key}"\s*:\s*("(?:[^"\\]|\\.)*")') for key in ("part_type", "vehicle_model")
+]
+
+def extract_search_fields(content):
+    matches = [pattern.search(content) for pattern in SEARCH_FIELD_PATTERNS]
+    if not all(matches):
+        return None
+    return tuple(json.loads(match.group(1)) for match in matches)
+
+# 🔍 Query LLaMA 3 to extract parts info, resolving search_fields as soon as they stream in.
+# Raises if the reply fails before the search fields arrive, so nothing downstream caches it.
+async def parse_query_llama3(query, search_fields=None):
     prompt = f"""
     Extract the automobile part type, automobile part model, vehicle model, and price range from the following query:
 
@@ -57,11 +74,20 @@ def parse_query_llama3(query):
     Respond in JSON format with keys: part_type, vehicle_model, price_range (as a list of two numbers).
     """
     try:
-        response = ollama.chat(
+        # Concurrent searches share one Ollama server; raise OLLAMA_NUM_PARALLEL
+        # on the server side so they are not queued behind each other.
+        stream = await ollama.AsyncClient().chat(
             model='llama3',
-            messages=[{'role': 'user', 'content': prompt}]
+            messages=[{'role': 'user', 'content': prompt}],
+            stream=True
         )
-        content = response['message']['content']
+        content = ""
+        async for chunk in stream:
+            content += chunk['message']['content']
+            if search_fields is not None and not search_fields.done():
+                fields = extract_search_fields(content)
+                if fields is not None:
+                    search_fields.set_result(fields)
         json_start = content.find('{')
         json_end = content.rfind('}')
         if json_start != -1 and json_end != -1:
@@ -71,58 +97,214 @@ def parse_query_llama3(query):
             raise ValueError("No valid JSON found in response.")
     except Exception as e:
         print("LLaMA 3 Parsing Error:", e)
-        return {"part_type": "", "vehicle_model": "", "price_range": [0, 999999]}
+        if search_fields is None or not search_fields.done():
+            raise
+        part_type, vehicle_model = search_fields.result()
+        return {"part_type": part_type, "vehicle_model": vehicle_model, "price_range": [0, 999999]}
 
-# 🔌 Build search URL for each site
-def get_search_url(site, query):
-    encoded_query = urllib.parse.quote_plus(query)
+# 🔌 Search URL templates for each site
+URL_TEMPLATES = {
+    "flipkart": "https://www.flipkart.com/search?q={q}",
+    "amazon": "https://www.amazon.in/s?k={q}",
+    "snapdeal": "https://www.snapdeal.com/search?keyword={q}",
+    "ebay": "https://www.ebay.com/sch/i.html?_nkw={q}",
+    "indiamart": "https://dir.indiamart.com/search.mp?ss={q}",
+    "boodmo": "https://boodmo.com/catalog/search/?q={q}",
+    "pricerunner": "https://www.pricerunner.com/search?q={q}",
+    "gomechanic": "https://gomechanic.in/spares?q={q}",
+    "cardekho": "https://www.cardekho.com/cars?q={q}",
+    "autodoc": "https://www.autodoc.co.uk/search?keyword={q}",
+    "motointegrator": "https://www.motointegrator.com/search?keyword={q}",
+    "partslink24": "https://www.partslink24.com/search?q={q}",
+    "tecalliance": "https://www.tecalliance.com/en/solutions/tecdoc-catalog?q={q}",
+    "camelcamelcamel": "https://camelcamelcamel.com/search?sq={q}"
+}
+
+# 🔌 Build search URL for each site (query already URL-encoded)
+def get_search_url(site, encoded_query):
     site = site.lower()
-    domain_map = {
-        "flipkart": f"https://www.flipkart.com/search?q={encoded_query}",
-        "amazon": f"https://www.amazon.in/s?k={encoded_query}",
-        "snapdeal": f"https://www.snapdeal.com/search?keyword={encoded_query}",
-        "ebay": f"https://www.ebay.com/sch/i.html?_nkw={encoded_query}",
-        "indiamart": f"https://dir.indiamart.com/search.mp?ss={encoded_query}",
-        "boodmo": f"https://boodmo.com/catalog/search/?q={encoded_query}",
-        "pricerunner": f"https://www.pricerunner.com/search?q={encoded_query}",
-        "gomechanic": f"https://gomechanic.in/spares?q={encoded_query}",
-        "cardekho": f"https://www.cardekho.com/cars?q={encoded_query}",
-        "autodoc": f"https://www.autodoc.co.uk/search?keyword={encoded_query}",
-        "motointegrator": f"https://www.motointegrator.com/search?keyword={encoded_query}",
-        "partslink24": f"https://www.partslink24.com/search?q={encoded_query}",
-        "tecalliance": f"https://www.tecalliance.com/en/solutions/tecdoc-catalog?q={encoded_query}",
-        "camelcamelcamel": f"https://camelcamelcamel.com/search?sq={encoded_query}"
+    template = URL_TEMPLATES.get(site)
+    if template is None:
+        return f"{site.rstrip('/')}/search?q={encoded_query}"
+    return template.format(q=encoded_query)
+
+# 🗄️ Shared on-disk cache of scraped results, one row per (query, site)
+CACHE_DIR = Path("cache")
+CACHE_DB = CACHE_DIR / "results.db"
+
+class ResultCache:
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "query TEXT NOT NULL, site TEXT NOT NULL, payload BLOB NOT NULL, "
+                "PRIMARY KEY (query, site))"
+            )
+
+    def get_many(self, query, sites):
+        placeholders = ",".join("?" * len(sites))
+        with self.lock:
+            rows = self.con.execute(
+                f"SELECT site, payload FROM results WHERE query = ? AND site IN ({placeholders})",
+                [query, *sites]
+            ).fetchall()
+        return {site: decode_results(payload) for site, payload in rows}
+
+    def put_many(self, query, site_results):
+        rows = [(query, site, orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY))
+                for site, results in site_results.items()]
+        with self.lock, self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO results (query, site, payload) VALUES (?, ?, ?)", rows
+            )
+
+    async def get_or_compute_many(self, query, sites, compute_many, persist=True):
+        site_results = self.get_many(query, sites)
+        missing = [site for site in sites if site not in site_results]
+        if missing:
+            fresh = dict(zip(missing, await compute_many(missing)))
+            if persist:
+                self.put_many(query, fresh)
+            site_results.update(fresh)
+        return [site_results[site] for site in sites]
+
+# One connection per server process, shared by every session
+@st.cache_resource
+def result_cache():
+    return ResultCache(CACHE_DB)
+
+# 📐 Results are kept column-wise: names/links as lists, prices/ratings as numpy arrays
+def make_results(names, prices, ratings, links):
+    return {
+        "name": list(names),
+        "price": np.asarray(prices, dtype=np.int32),
+        "rating": np.asarray(ratings, dtype=np.float32),
+        "link": list(links)
     }
-    return domain_map.get(site, f"{site.rstrip('/')}/search?q={encoded_query}")
-
-# 📦 Simulated scraper with caching
-def scrape_site(query, site):
-    filename = f"cache/{hashlib.md5((query + site).encode()).hexdigest()}.json"
-    os.makedirs("cache", exist_ok=True)
-    if os.path.exists(filename):
-        with open(filename, "r") as f:
-            return json.load(f)
-
-    result = [{
-        "name": f"{query} - Sample from {site}",
-        "price": random.randint(1200, 2000),
-        "rating": round(random.uniform(3.8, 4.5), 2),
-        "link": get_search_url(site, query)
-    }]
-    with open(filename, "w") as f:
-        json.dump(result, f)
-    return result
+
+def concat_results(site_results):
+    return make_results(
+        [name for results in site_results for name in results["name"]],
+        np.concatenate([results["price"] for results in site_results]),
+        np.concatenate([results["rating"] for results in site_results]),
+        [link for results in site_results for link in results["link"]]
+    )
+
+def decode_results(payload):
+    columns = orjson.loads(payload)
+    return make_results(columns["name"], columns["price"], columns["rating"], columns["link"])
+
+# 🔗 Pooled keep-alive HTTP/2 connections shared by the scrapers of one search.
+# The client is opened on the first fetch, so searches that fetch nothing skip its setup.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+class LazyHttpClient:
+    def __init__(self):
+        self.client = None
+
+    async def get(self, url):
+        if self.client is None:
+            self.client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=10)
+        return await self.client.get(url)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+# 📦 Simulated scraper; a live one fetches get_search_url(...) through http.get
+rng = np.random.default_rng()
+
+async def scrape_site(http, query, site, encoded_query):
+    return make_results(
+        [f"{query} - Sample from {site}"],
+        rng.integers(1200, 2001, size=1),
+        rng.uniform(3.8, 4.5, size=1).round(2),
+        [get_search_url(site, encoded_query)]
+    )
+
+# 🚀 Scrape every supported site concurrently, serving cached sites from one lookup
+async def scrape_all_sites(query, persist=True):
+    # Encoded once per search and shared by every site
+    encoded_query = urllib.parse.quote_plus(query)
+
+    # Only cache misses get a client, and it is closed before this event loop ends
+    async def scrape_missing(sites):
+        http = LazyHttpClient()
+        try:
+            return await asyncio.gather(*[scrape_site(http, query, site, encoded_query) for site in sites])
+        finally:
+            await http.aclose()
+
+    site_results = await result_cache().get_or_compute_many(query, supported_sites, scrape_missing, persist)
+    return concat_results(site_results)
+
+# 🧭 Full search pipeline: start scraping once the LLM has streamed the search fields
+async def run_search(user_query):
+    search_fields = asyncio.get_running_loop().create_future()
+    llm_task = asyncio.create_task(parse_query_llama3(user_query, search_fields))
+    await asyncio.wait([llm_task, search_fields], return_when=asyncio.FIRST_COMPLETED)
+    if search_fields.done():
+        part_type, vehicle_model = search_fields.result()
+    else:
+        parsed = llm_task.result()
+        part_type, vehicle_model = parsed['part_type'], parsed['vehicle_model']
+
+    search_query = f"{part_type} for {vehicle_model}"
+    # An empty parse would otherwise leave " for " rows in results.db for good
+    persist = bool(part_type or vehicle_model)
+    all_results, _ = await asyncio.gather(scrape_all_sites(search_query, persist), llm_task)
+    return search_query, all_results
+
+# 💾 Memoize whole searches in memory; cache/results.db stays as the persistent tier.
+# A failed LLM parse raises out of here, and st.cache_data does not cache exceptions.
+@st.cache_data(ttl=3600, show_spinner=False)
+def search_parts(user_query):
+    return asyncio.run(run_search(user_query))
 
 # 🏆 Choose best product
 def choose_optimal(results):
-    df = pd.DataFrame(results)
-    if df.empty:
-        return pd.DataFrame()
+    if not len(results["price"]):
+        return None
+
+    # score = (1 - norm_price) * 0.6 + norm_rating * 0.4, built up in one buffer
+    score = results["price"].astype(np.float32)
+    score -= score.min()
+    score *= -0.6 / (score.max() + 1e-6)
+    score += 0.6
+    ratings = results["rating"]
+    norm_rating = ratings - ratings.min()
+    norm_rating *= 0.4 / (norm_rating.max() + 1e-6)
+    score += norm_rating
+    best = int(score.argmax())
+    return {column: values[best] for column, values in results.items()}
+
+# 📄 Serialize results for the CSV download (once per search; kept in session_state)
+def results_to_csv(results_df):
+    return results_df.to_csv(index=False).encode("utf-8")
 
-    df["norm_price"] = (df["price"] - df["price"].min()) / (df["price"].max() - df["price"].min() + 1e-6)
-    df["norm_rating"] = (df["rating"] - df["rating"].min()) / (df["rating"].max() - df["rating"].min() + 1e-6)
-    df["score"] = (1 - df["norm_price"]) * 0.6 + df["norm_rating"] * 0.4
-    return df.sort_values(by="score", ascending=False).head(1)
+# 📊 Results view; interacting with it reruns only this fragment, not the search
+@st.fragment
+def render_results():
+    st.write("🔍 **Search Query:**", st.session_state["query"])
+    st.write("📦 **All Search Results:**")
+    st.dataframe(st.session_state["results_df"])
+
+    st.download_button(
+        label="⬇️ Download Results as CSV",
+        data=st.session_state["csv_bytes"],
+        file_name="auto_parts_results.csv",
+        mime="text/csv"
+    )
+
+    st.write("✅ **Optimal Recommendation:**")
+    if st.session_state["optimal"] is not None:
+        st.dataframe(pd.DataFrame([st.session_state["optimal"]], columns=["name", "price", "rating", "link"]))
+    else:
+        st.warning("No suitable products found.")
 
 # 🌐 Supported sites
 supported_sites = [
@@ -138,10 +320,12 @@ if "show_results" not in st.session_state:
     st.session_state["show_results"] = False
 if "query" not in st.session_state:
     st.session_state["query"] = ""
-if "results" not in st.session_state:
-    st.session_state["results"] = []
+if "results_df" not in st.session_state:
+    st.session_state["results_df"] = pd.DataFrame()
+if "csv_bytes" not in st.session_state:
+    st.session_state["csv_bytes"] = b""
 if "optimal" not in st.session_state:
-    st.session_state["optimal"] = pd.DataFrame()
+    st.session_state["optimal"] = None
 
 col1, col2 = st.columns([4, 1])
 with col1:
@@ -149,8 +333,9 @@ with col1:
 with col2:
     if st.button("🧹 Clear"):
         st.session_state["query"] = ""
-        st.session_state["results"] = []
-        st.session_state["optimal"] = pd.DataFrame()
+        st.session_state["results_df"] = pd.DataFrame()
+        st.session_state["csv_bytes"] = b""
+        st.session_state["optimal"] = None
         st.session_state["show_results"] = False
         st.rerun()  # ✅ Updated here
 
@@ -158,39 +343,25 @@ if user_query and not st.session_state["show_results"]:
     loader_placeholder = st.empty()
     show_loader(loader_placeholder)
 
-    parsed = parse_query_llama3(user_query)
-    search_query = f"{parsed['part_type']} for {parsed['vehicle_model']}"
-    all_results = []
-
-    for site in supported_sites:
-        all_results.extend(scrape_site(search_query, site))
-
-    optimal_df = choose_optimal(all_results)
-
-    st.session_state["query"] = search_query
-    st.session_state["results"] = all_results
-    st.session_state["optimal"] = optimal_df
-    st.session_state["show_results"] = True
+    try:
+        search_query, all_results = search_parts(user_query)
+    except Exception as e:
+        print("Search Error:", e)
+        search_query, all_results = None, None
     loader_placeholder.empty()
-    st.rerun()  # ✅ Updated here
 
-# Show results if available
-if st.session_state["show_results"]:
-    st.write("🔍 **Search Query:**", st.session_state["query"])
-    results_df = pd.DataFrame(st.session_state["results"])
-    st.write("📦 **All Search Results:**")
-    st.dataframe(results_df)
+    if all_results is None:
+        st.warning("Could not interpret the request with LLaMA 3. Please try again.")
+    else:
+        optimal = choose_optimal(all_results)
+        results_df = pd.DataFrame(all_results)
 
-    csv_data = results_df.to_csv(index=False).encode("utf-8")
-    st.download_button(
-        label="⬇️ Download Results as CSV",
-        data=csv_data,
-        file_name="auto_parts_results.csv",
-        mime="text/csv"
-    )
+        st.session_state["query"] = search_query
+        st.session_state["results_df"] = results_df
+        st.session_state["csv_bytes"] = results_to_csv(results_df)
+        st.session_state["optimal"] = optimal
+        st.session_state["show_results"] = True
 
-    st.write("✅ **Optimal Recommendation:**")
-    if not st.session_state["optimal"].empty:
-        st.dataframe(st.session_state["optimal"][["name", "price", "rating", "link"]])
-    else:
-        st.warning("No suitable products found.")
+# Show results if available (same run as the search that produced them)
+if st.session_state["show_results"]:
+    render_results()